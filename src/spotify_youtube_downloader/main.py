@@ -1,168 +1,524 @@
+import requests
 import spotipy
+from requests.adapters import HTTPAdapter
 from spotipy.oauth2 import SpotifyClientCredentials
+from urllib3.util.retry import Retry
 import re
 import os
 import sys
 import subprocess
+import shutil
+import threading
 import string
 import argparse
+import asyncio
+import bisect
+import collections
+import functools
+import glob
+import hashlib
+import json
+import math
+import shlex
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from types import SimpleNamespace
 from urllib.parse import urlparse, parse_qs
 from dotenv import load_dotenv
 
-# Load environment variables from .env file, if it exists
-load_dotenv()
+try:
+    import yt_dlp
+except ImportError: # Only needed for --in-process; the yt-dlp executable is used otherwise
+    yt_dlp = None
 
 # --- Configuration ---
-client_id = os.getenv('SPOTIPY_CLIENT_ID')
-client_secret = os.getenv('SPOTIPY_CLIENT_SECRET')
+@functools.lru_cache(maxsize=1)
+def _spotify_creds():
+    """Loads Spotify credentials on first use (from .env, if it exists, or the environment)."""
+    load_dotenv()
+    return os.getenv('SPOTIPY_CLIENT_ID'), os.getenv('SPOTIPY_CLIENT_SECRET')
 
 # --- Constants ---
+TRACKING_BLOOM_THRESHOLD_BYTES = 1_000_000 # Tracking files larger than this are loaded into a Bloom filter
+TRACKING_BLOOM_ERROR_RATE = 0.001 # False-positive rate of that filter
+VERBOSE = os.getenv('SYD_VERBOSE') == '1' # Set SYD_VERBOSE=1 to print yt-dlp commands and output templates
 # YT_DLP_EXECUTABLE = 'yt-dlp' # Defined within run() now based on args if needed
+SPOTIFY_MAX_CONCURRENT_REQUESTS = 8 # Parallel page requests when walking a playlist/show
+SPOTIFY_MAX_RETRIES = 5 # Attempts per page when Spotify answers 429 Too Many Requests
+SPOTIFY_REQUESTS_PER_SECOND = 10 # Default sustained Spotify API request rate (see LeakyBucket)
+SPOTIFY_RETRY_STATUSES = (500, 502, 503, 504) # Retried at the HTTP layer; 429 is left to _spotify_call so it sees Retry-After
+SPOTIFY_PLAYLIST_PAGE_SIZE = 100 # Items per playlist page requested; the step follows the 'limit' Spotify echoes back
+SPOTIFY_SHOW_PAGE_SIZE = 50 # The shows/{id}/episodes endpoint caps limit at 50
+SPOTIFY_FALLBACK_PAGE_SIZE = 50 # Used if Spotify rejects a larger limit with HTTP 400
+SPOTIFY_HTTP_POOL_SIZE = 16 # Keep-alive connections kept open to the Spotify API
+SPOTIFY_CACHE_TTL_SECONDS = 0 # Default --cache-ttl: off, so new episodes are never hidden by a cached listing
+YT_DLP_CONCURRENT_FRAGMENTS = 4 # Default for -N/--concurrent-fragments, per download
+YT_DLP_OUTPUT_TAIL_LINES = 50 # Lines of yt-dlp output kept per run for error reporting
+DESCRIPTION_SCAN_LIMIT = 8192 # Show notes put their YouTube link near the top; don't regex-scan the rest
+DESCRIPTION_SCAN_BATCH_SIZE = 500 # Episodes joined per regex pass when scanning descriptions
+# Patterns are compiled once here; none of the per-episode/per-file helpers compile regexes at call time
+_WHITESPACE_RE = re.compile(r'\s')
+_SPOTIFY_KINDS = {'playlist': 'spotify_playlist', 'show': 'spotify_show', 'episode': 'spotify_episode'} # Path segment -> item type
+# Final (post-processed) extensions only, so interrupted downloads/intermediate files are not mistaken for finished ones
+_EXISTING_FILE_ID_RES = {
+    'audio': re.compile(r'\[([A-Za-z0-9_-]+)\]\.mp3$'),
+    'video': re.compile(r'\[([A-Za-z0-9_-]+)\]\.(?:mp4|mkv|webm)$'),
+}
+_YT_LINK_RE = re.compile(r'(https?://(?:www\.)?(?:youtube\.com/(?:watch\?v=|embed/)|youtu\.be/)[\w-]+(?:\?[^\s<]*)?)')
+_DESCRIPTION_SEPARATOR = '\n\x1e\n' # Whitespace-delimited record separator; ends any link match
+# yt-dlp's message (exit code 0) when --download-archive skips a video that another item already downloaded
+_ARCHIVED_RE = re.compile(r'has already been recorded in the archive')
+# yt-dlp errors that browser cookies can fix (bot check, age gate, private/members-only); others aren't retried with cookies
+_AUTH_ERR_RE = re.compile(r"(sign in|age[- ]restricted|inappropriate for some users|members[- ]only|private video|login required|--cookies)", re.I)
 
 # --- Helper Functions ---
 
-def get_id_and_type_from_url(url):
-    """Extracts the ID/URL and type (spotify_playlist, spotify_show, youtube_playlist) from a URL."""
-    parsed_url = urlparse(url)
-    netloc = parsed_url.netloc.lower()
-    path_parts = [part for part in parsed_url.path.split('/') if part]
+def _parse_spotify_url(url, parsed_url):
+    """Returns (id, 'spotify_<kind>') for the first playlist/show/episode segment followed by an ID.
 
-    # Spotify Check
-    if netloc in ["open.spotify.com", "spotify.link"]:
-        try:
-            # Prioritize specific types if multiple keywords exist (e.g., playlist over track in path)
-            if 'playlist' in path_parts:
-                id_index = path_parts.index('playlist') + 1
-                if id_index < len(path_parts): return path_parts[id_index].split('?')[0], 'spotify_playlist'
-            elif 'show' in path_parts:
-                id_index = path_parts.index('show') + 1
-                if id_index < len(path_parts): return path_parts[id_index].split('?')[0], 'spotify_show'
-            elif 'episode' in path_parts: # Can add handling for single episodes later if needed
-                 id_index = path_parts.index('episode') + 1
-                 if id_index < len(path_parts): return path_parts[id_index].split('?')[0], 'spotify_episode' # Example type
-                 pass
-        except (ValueError, IndexError): pass
-
-    # YouTube Playlist Check
-    elif netloc in ["www.youtube.com", "youtube.com", "m.youtube.com", "music.youtube.com", "youtu.be"]:
-        query_params = parse_qs(parsed_url.query)
-        if 'list' in query_params and query_params['list']:
-            return url, 'youtube_playlist'
+    One pass over the path segments, so /intl-xx/, /user/<name>/ and /embed/ prefixes all work.
+    """
+    path_parts = [part for part in parsed_url.path.split('/') if part]
+    for i, part in enumerate(path_parts[:-1]):
+        kind = _SPOTIFY_KINDS.get(part)
+        if kind: return path_parts[i + 1].split('?', 1)[0], kind
+    return None, None
 
+def _parse_youtube_url(url, parsed_url):
+    """Returns (url, 'youtube_playlist') if the URL carries a playlist ('list') parameter."""
+    query_params = parse_qs(parsed_url.query)
+    if query_params.get('list'): return url, 'youtube_playlist'
     return None, None
 
-def find_youtube_links(text):
-    """Finds all YouTube links in a given string using regex."""
-    if not text: return []
-    regex = r'(https?://(?:www\.)?(?:youtube\.com/(?:watch\?v=|embed/)|youtu\.be/)[\w-]+(?:\?[^\s<]*)?)'
-    return re.findall(regex, text)
+_SPOTIFY_HOSTS = frozenset({"open.spotify.com", "spotify.link"})
+_YT_HOSTS = frozenset({"www.youtube.com", "youtube.com", "m.youtube.com", "music.youtube.com", "youtu.be"})
+# Netloc -> parser dispatch table; add new sources here
+_URL_PARSERS = {**{host: _parse_spotify_url for host in _SPOTIFY_HOSTS}, **{host: _parse_youtube_url for host in _YT_HOSTS}}
 
-def fetch_episodes_from_playlist(sp, playlist_id):
-    episodes = []
-    offset, limit = 0, 50
-    print(f"\nFetching episodes from Spotify playlist ID: {playlist_id}")
-    while True:
+def get_id_and_type_from_url(url):
+    """Extracts the ID/URL and type (spotify_playlist, spotify_show, spotify_episode, youtube_playlist) from a URL."""
+    parsed_url = urlparse(url)
+    parser = _URL_PARSERS.get(parsed_url.netloc.lower())
+    return parser(url, parsed_url) if parser else (None, None)
+
+def _truncate_description(text, max_len=DESCRIPTION_SCAN_LIMIT):
+    """Cuts text to roughly max_len characters, extending to the next whitespace so a link is never split."""
+    if not text or len(text) <= max_len: return text or ''
+    boundary = _WHITESPACE_RE.search(text, max_len)
+    return text[:boundary.start()] if boundary else text
+
+def find_youtube_links(text, max_len=DESCRIPTION_SCAN_LIMIT):
+    """Finds all YouTube links in the first max_len characters of a given string using regex."""
+    return _YT_LINK_RE.findall(_truncate_description(text, max_len)) if text else []
+
+def build_spotify_session():
+    """Creates a pooled, retrying requests.Session so paginated Spotify calls reuse keep-alive connections."""
+    session = requests.Session()
+    retry = Retry(total=SPOTIFY_MAX_RETRIES, backoff_factor=0.5, status_forcelist=SPOTIFY_RETRY_STATUSES) # Server errors only
+    adapter = HTTPAdapter(pool_connections=SPOTIFY_HTTP_POOL_SIZE, pool_maxsize=SPOTIFY_HTTP_POOL_SIZE, max_retries=retry)
+    session.mount('https://', adapter)
+    return session
+
+class LeakyBucket:
+    """Async rate limiter: a burst of up to rate_per_sec requests, then one more slot leaks back every 1/rate_per_sec s.
+
+    Keeps sustained Spotify traffic just under the rate limit instead of bursting into 429s and stalling on
+    Retry-After. Created outside the event loop; the semaphore and leak task start on first use inside it.
+    """
+    def __init__(self, rate_per_sec):
+        self.rate_per_sec = rate_per_sec
+        self._semaphore = None
+        self._leak_task = None
+
+    async def _leak(self):
+        while True:
+            await asyncio.sleep(1 / self.rate_per_sec)
+            try: self._semaphore.release()
+            except ValueError: pass # Bucket already full
+
+    async def __aenter__(self):
+        if self._leak_task is None:
+            self._semaphore = asyncio.BoundedSemaphore(self.rate_per_sec)
+            self._leak_task = asyncio.ensure_future(self._leak())
+        await self._semaphore.acquire()
+
+    async def __aexit__(self, *exc_info):
+        pass # Slots are returned by the leak task, not on exit
+
+    async def aclose(self):
+        """Stops the leak task."""
+        if self._leak_task is not None:
+            self._leak_task.cancel()
+            try: await self._leak_task
+            except asyncio.CancelledError: pass
+
+async def _spotify_call(semaphore, bucket, func, *args, **kwargs):
+    """Runs a blocking Spotipy call in a worker thread under the rate limiter, retrying HTTP 429s.
+
+    Waits for Retry-After when Spotify sends it, otherwise backs off exponentially (1s, 2s, 4s, ...).
+    """
+    for attempt in range(SPOTIFY_MAX_RETRIES):
+        async with semaphore, bucket:
+            try:
+                return await asyncio.to_thread(func, *args, **kwargs)
+            except spotipy.SpotifyException as e:
+                if e.http_status != 429 or attempt == SPOTIFY_MAX_RETRIES - 1: raise
+                retry_after = float((e.headers or {}).get('Retry-After') or 2 ** attempt)
+        print(f"  Rate limited by Spotify, retrying in {retry_after:.0f}s...")
+        await asyncio.sleep(retry_after)
+
+async def _fetch_pages(func, offsets, bucket, *args, **kwargs):
+    """Requests the given offsets concurrently (bounded by a semaphore and the rate limiter) and returns the pages in offset order."""
+    semaphore = asyncio.Semaphore(SPOTIFY_MAX_CONCURRENT_REQUESTS)
+    return await asyncio.gather(*[_spotify_call(semaphore, bucket, func, *args, offset=offset, **kwargs) for offset in offsets])
+
+def _iter_pages(func, *args, limit=50, requests_per_second=SPOTIFY_REQUESTS_PER_SECOND, **kwargs):
+    """Yields pages in offset order: the first page (to learn 'total'), then windows of concurrent requests.
+
+    Only one window of pages is held at a time, so memory stays bounded regardless of playlist/show size
+    (iter_cached_episodes streams pages to and from its cache file, so this holds with --cache-ttl too).
+    All requests share one event loop and one LeakyBucket limited to requests_per_second. If Spotify rejects a
+    limit above SPOTIFY_FALLBACK_PAGE_SIZE with HTTP 400, the first page is retried at that size.
+    """
+    loop = asyncio.new_event_loop()
+    bucket = LeakyBucket(requests_per_second)
+    try:
         try:
-            results = sp.playlist_items(playlist_id, fields='items(track(name, id, type, description, episode)), next', additional_types=['episode'], limit=limit, offset=offset)
-            if not results or 'items' not in results: break
-            items = results.get('items', [])
-            if not items: break
-            fetched_count = 0
-            for item in items:
-                track_info = item.get('track')
-                if track_info and track_info.get('type') == 'episode':
-                    episodes.append({'name': track_info.get('name', 'Unknown Episode'), 'id': track_info.get('id', 'Unknown ID'), 'description': track_info.get('description', '')})
-                    fetched_count += 1
-            print(f"  Fetched {fetched_count} Spotify episodes (offset {offset}). Total: {len(episodes)}")
-            offset += len(items)
-            if results.get('next') is None: break
-        except spotipy.SpotifyException as e: print(f"Spotify API Error: {e}"); return None
-        except Exception as e: print(f"Unexpected error fetching Spotify playlist: {e}"); return None
-    print(f"Finished fetching playlist. Total Spotify episodes: {len(episodes)}")
-    return episodes
-
-def fetch_episodes_from_show(sp, show_id):
-    """Fetches episodes from Spotify show."""
-    episodes = []
-    offset, limit = 0, 50
+            first, = loop.run_until_complete(_fetch_pages(func, [0], bucket, *args, limit=limit, **kwargs))
+        except spotipy.SpotifyException as e:
+            if e.http_status != 400 or limit <= SPOTIFY_FALLBACK_PAGE_SIZE: raise
+            limit = SPOTIFY_FALLBACK_PAGE_SIZE
+            first, = loop.run_until_complete(_fetch_pages(func, [0], bucket, *args, limit=limit, **kwargs))
+        if not first: return
+        yield first
+        if not first.get('items'): return
+        page_size = first.get('limit') or limit # Step by the page size Spotify actually applied
+        offsets = range(page_size, first.get('total', 0), page_size)
+        for start in range(0, len(offsets), SPOTIFY_MAX_CONCURRENT_REQUESTS):
+            window = offsets[start:start + SPOTIFY_MAX_CONCURRENT_REQUESTS]
+            yield from loop.run_until_complete(_fetch_pages(func, window, bucket, *args, limit=page_size, **kwargs))
+    finally:
+        loop.run_until_complete(bucket.aclose())
+        loop.run_until_complete(loop.shutdown_default_executor())
+        loop.close()
+
+def _scan_episode_batch(episodes):
+    """Runs the YouTube link regex once over a batch of joined episode descriptions."""
+    descriptions = [_truncate_description(episode['description']) for episode in episodes]
+    starts, position = [], 0
+    for description in descriptions:
+        starts.append(position)
+        position += len(description) + len(_DESCRIPTION_SEPARATOR)
+    links_by_index = {}
+    for match in _YT_LINK_RE.finditer(_DESCRIPTION_SEPARATOR.join(descriptions)):
+        links_by_index.setdefault(bisect.bisect_right(starts, match.start()) - 1, []).append(match.group(1))
+    return [(episodes[index], links) for index, links in links_by_index.items()]
+
+def find_youtube_links_by_episode(episodes, batch_size=DESCRIPTION_SCAN_BATCH_SIZE):
+    """Finds YouTube links across episode descriptions with one regex pass per batch of episodes.
+
+    Descriptions are joined with a separator that can't appear inside a link, and each match is
+    mapped back to its episode by offset. Accepts any iterable (e.g. a fetch generator) and yields
+    (episode, [links...]) in episode order, holding at most one batch of episodes at a time.
+    """
+    batch = []
+    for episode in episodes:
+        batch.append(episode)
+        if len(batch) >= batch_size:
+            yield from _scan_episode_batch(batch)
+            batch = []
+    if batch: yield from _scan_episode_batch(batch)
+
+def iter_episodes_from_playlist(sp, playlist_id, requests_per_second=SPOTIFY_REQUESTS_PER_SECOND):
+    """Yields episodes from a Spotify playlist as pages arrive. Spotify API errors propagate to the caller."""
+    offset, total = 0, 0
+    print(f"\nFetching episodes from Spotify playlist ID: {playlist_id}")
+    for results in _iter_pages(sp.playlist_items, playlist_id, fields='total,limit,items(track(name,id,type,description))', additional_types=['episode'], limit=SPOTIFY_PLAYLIST_PAGE_SIZE, requests_per_second=requests_per_second):
+        items = (results or {}).get('items', [])
+        if not items: break
+        fetched_count = 0
+        for item in items:
+            track_info = item.get('track')
+            if track_info and track_info.get('type') == 'episode':
+                fetched_count += 1
+                yield {'name': track_info.get('name', 'Unknown Episode'), 'id': track_info.get('id', 'Unknown ID'), 'description': track_info.get('description', '')}
+        total += fetched_count
+        print(f"  Fetched {fetched_count} Spotify episodes (offset {offset}). Total: {total}")
+        offset += len(items)
+    print(f"Finished fetching playlist. Total Spotify episodes: {total}")
+
+def iter_episodes_from_show(sp, show_id, requests_per_second=SPOTIFY_REQUESTS_PER_SECOND):
+    """Yields episodes from a Spotify show as pages arrive. Spotify API errors propagate to the caller."""
+    offset, total = 0, 0
     print(f"\nFetching episodes from Spotify show ID: {show_id}")
-    while True:
-        try:
-            results = sp.show_episodes(show_id, limit=limit, offset=offset)
-            if not results or 'items' not in results: break
-            items = results.get('items', [])
-            if not items: break
-            for item in items: episodes.append({'name': item.get('name', 'Unknown Episode'), 'id': item.get('id', 'Unknown ID'), 'description': item.get('description', '')})
-            print(f"  Fetched {len(items)} Spotify episodes (offset {offset}). Total: {len(episodes)}")
-            offset += len(items)
-            if results.get('next') is None: break
-        except spotipy.SpotifyException as e: print(f"Spotify API Error: {e}"); return None
-        except Exception as e: print(f"Unexpected error fetching Spotify show: {e}"); return None
-    print(f"Finished fetching show. Total Spotify episodes: {len(episodes)}")
-    return episodes
+    for results in _iter_pages(sp.show_episodes, show_id, limit=SPOTIFY_SHOW_PAGE_SIZE, requests_per_second=requests_per_second):
+        items = (results or {}).get('items', [])
+        if not items: break
+        for item in items: yield {'name': item.get('name', 'Unknown Episode'), 'id': item.get('id', 'Unknown ID'), 'description': item.get('description', '')}
+        total += len(items)
+        print(f"  Fetched {len(items)} Spotify episodes (offset {offset}). Total: {total}")
+        offset += len(items)
+    print(f"Finished fetching show. Total Spotify episodes: {total}")
+
+def iter_cached_episodes(cache_file, fetch_episodes, ttl):
+    """Yields episodes from cache_file if it was written within ttl seconds, else from fetch_episodes().
+
+    Both directions stream one JSON line per episode, so a cached listing is never held in memory. A fresh fetch
+    is written to a temp file that only replaces cache_file once the whole listing arrived. ttl <= 0 disables it.
+    """
+    if ttl <= 0: yield from fetch_episodes(); return
+    try: age = time.time() - os.path.getmtime(cache_file)
+    except OSError: age = None
+    if age is not None and age < ttl:
+        print(f"\nUsing Spotify episodes cached {age:.0f}s ago in {cache_file} (newer episodes won't appear until it expires).")
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            for line in f: yield json.loads(line)
+        return
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(cache_file), suffix='.tmp')
+    except OSError as e: print(f"Warning: Could not write Spotify cache {cache_file}: {e}"); yield from fetch_episodes(); return
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as cache_fp:
+            for episode in fetch_episodes():
+                cache_fp.write(json.dumps(episode) + '\n')
+                yield episode
+        os.replace(temp_path, cache_file) # Only reached when the whole listing was fetched without errors
+    finally:
+        if os.path.exists(temp_path): os.remove(temp_path)
 
 def fetch_youtube_playlist_items(playlist_url, yt_dlp_executable):
-    """Fetches Video ID, Title, and URL for items in a YouTube playlist using yt-dlp."""
+    """Fetches Video ID, Title, and URL for items in a YouTube playlist using yt-dlp.
+
+    yt-dlp prints one JSON object per entry (--dump-json), which is parsed as it arrives rather than
+    after the whole listing has been buffered.
+    """
     print(f"\nFetching video list from YouTube playlist: {playlist_url}")
+    command = [yt_dlp_executable, '--flat-playlist', '--dump-json', playlist_url]
+    if VERBOSE: print('  Running:', shlex.join(command))
     items = []
-    command = [yt_dlp_executable, '--flat-playlist', '--print', '%(id)s;%(title)s;%(webpage_url)s', playlist_url]
-    print(f"  Running: {' '.join(command)}")
     try:
-        result = subprocess.run(command, capture_output=True, text=True, check=False, encoding='utf-8')
-        if result.returncode != 0: print(f"\nERROR: yt-dlp failed (Exit Code: {result.returncode}).\nStderr: {result.stderr}"); return None
-        if not result.stdout: return []
-        lines = result.stdout.strip().split('\n')
-        for line in lines:
-            parts = line.split(';', 2)
-            if len(parts) == 3: items.append({'link': parts[2].strip(), 'episode_name': parts[1].strip(), 'episode_id': parts[0].strip()})
-            else: print(f"  Warning: Skipping malformed line: {line}")
+        # stderr goes to a temp file so a chatty yt-dlp can't fill the pipe and stall while stdout is read
+        with tempfile.TemporaryFile(mode='w+', encoding='utf-8') as stderr_file:
+            with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr_file, text=True, encoding='utf-8', bufsize=1) as proc:
+                for line in proc.stdout:
+                    if not line.strip(): continue
+                    e = json.loads(line)
+                    if e and e.get('id'): items.append({'link': e.get('url') or e.get('webpage_url'), 'episode_name': e.get('title') or 'Unknown Item', 'episode_id': e['id']})
+            if proc.returncode != 0:
+                stderr_file.seek(0)
+                print(f"\nERROR: yt-dlp failed (Exit Code: {proc.returncode}).\nStderr: {stderr_file.read()}"); return None
         print(f"  Successfully fetched info for {len(items)} videos.")
         return items
     except FileNotFoundError: print(f"\nERROR: '{yt_dlp_executable}' not found."); return None
     except Exception as e: print(f"\nUnexpected error fetching YT playlist: {e}"); return None
 
 # --- Download & Tracking Helpers ---
+class _FilenameTranslation(dict):
+    """str.translate table mapping characters outside [\\w\\s.-] to '_', filled in lazily per character."""
+    def __missing__(self, char_code):
+        char = chr(char_code)
+        keep = char.isalnum() or char.isspace() or char in '_-.' # Same classes as the regex [\w\s\-\.]
+        self[char_code] = char_code if keep else '_'
+        return self[char_code]
+
+_FILENAME_TRANSLATION = _FilenameTranslation()
+
 def sanitize_filename(name):
     """Removes or replaces characters illegal in filenames."""
     # Allow alphanumeric, spaces, hyphens, underscores, periods. Replace others.
     # Limit length and handle potential edge cases.
-    name = re.sub(r'[^\w\s\-\.]', '_', name)
-    name = re.sub(r'\s+', ' ', name).strip()
+    name = ' '.join(name.translate(_FILENAME_TRANSLATION).split())
     return name[:150] if name else "Untitled"
 
+class _BloomFilter:
+    """Compact probabilistic set used for very large tracking files (~1.8 bytes per ID at a 0.1% error rate).
+
+    Membership has no false negatives, but a hit may be a false positive: run() confirms the hits for the
+    current tasks with confirm_tracked_ids before skipping anything.
+    """
+    def __init__(self, capacity, error_rate=TRACKING_BLOOM_ERROR_RATE):
+        capacity = max(capacity, 1)
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.key = os.urandom(16)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16, key=self.key).digest()
+        h1, h2 = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes)) # Double hashing
+
+    def add(self, item):
+        for pos in self._positions(item): self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def update(self, items):
+        for item in items: self.add(item)
+
+    def __contains__(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+    def __len__(self):
+        return self.count
+
 def load_downloaded_ids(tracking_file):
-    """Loads already downloaded IDs (Spotify or YouTube) from the tracking file."""
+    """Loads already downloaded IDs (Spotify or YouTube) from the tracking file.
+
+    Returns a set, or a _BloomFilter when the file exceeds TRACKING_BLOOM_THRESHOLD_BYTES. Callers should
+    only rely on `in`, add(), update() and len(), and confirm filter hits with confirm_tracked_ids.
+    """
     downloaded = set()
     try:
-        with open(tracking_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                clean_id = line.strip()
-                if clean_id: downloaded.add(clean_id)
+        file_size = os.path.getsize(tracking_file)
+        if file_size > TRACKING_BLOOM_THRESHOLD_BYTES:
+            # Stream into a Bloom filter; every ID is at least 11 chars + newline, which bounds the capacity
+            downloaded = _BloomFilter(capacity=file_size // 12)
+            with open(tracking_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    clean_id = line.strip()
+                    if clean_id: downloaded.add(clean_id)
+        else:
+            with open(tracking_file, 'rb') as f:
+                data = f.read()
+            # One bulk read, decode and whitespace split, all in C: no per-line strip() or add() in Python.
+            # IDs never contain whitespace, and split() already drops blank lines and '\r'.
+            downloaded = set(data.decode('utf-8').split())
         print(f"\nLoaded {len(downloaded)} previously downloaded IDs from {tracking_file}.")
     except FileNotFoundError: print(f"\nTracking file '{tracking_file}' not found. Starting fresh.")
     except Exception as e: print(f"\nError reading tracking file {tracking_file}: {e}")
     return downloaded
 
-def log_downloaded_id(tracking_file, item_id):
-    """Appends a successfully downloaded ID (Spotify or YouTube) to the tracking file."""
+class _TrackingDB:
+    """SQLite index over the tracking file (--tracking-db): indexed lookups instead of loading every ID at startup.
+
+    The text tracking file stays authoritative (batch mode and older versions append to it). Each open imports
+    only the lines appended since the last run, so the index can be deleted at any time and is rebuilt from it.
+    Supports the same `in`, add(), update() and len() as the set returned by load_downloaded_ids.
+    """
+    def __init__(self, db_file, tracking_file):
+        self.conn = sqlite3.connect(db_file, check_same_thread=False) # Workers only write under tracking_lock
+        self.conn.execute("CREATE TABLE IF NOT EXISTS dl(id TEXT PRIMARY KEY, ts INTEGER)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta(key TEXT PRIMARY KEY, value INTEGER)")
+        self._import_tracking_file(tracking_file)
+
+    def _import_tracking_file(self, tracking_file):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'log_offset'").fetchone()
+        offset = row[0] if row else 0
+        try:
+            with open(tracking_file, 'rb') as f:
+                if os.fstat(f.fileno()).st_size < offset: offset = 0 # File was truncated/replaced: import it again
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError: return
+        complete = data[:data.rfind(b'\n') + 1] # A partially written last line is picked up next time
+        self.update(complete.decode('utf-8').split())
+        with self.conn: self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('log_offset', ?)", (offset + len(complete),))
+
+    def __contains__(self, item_id):
+        return self.conn.execute("SELECT 1 FROM dl WHERE id = ?", (item_id,)).fetchone() is not None
+
+    def add(self, item_id):
+        with self.conn: self.conn.execute("INSERT OR IGNORE INTO dl VALUES (?, strftime('%s', 'now'))", (item_id,))
+
+    def update(self, item_ids):
+        with self.conn: self.conn.executemany("INSERT OR IGNORE INTO dl VALUES (?, strftime('%s', 'now'))", ((item_id,) for item_id in item_ids))
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM dl").fetchone()[0]
+
+def open_tracking_db(db_file, tracking_file):
+    """Opens the SQLite tracking index, falling back to load_downloaded_ids if it can't be used."""
+    try:
+        downloaded = _TrackingDB(db_file, tracking_file)
+        print(f"\nTracking index {db_file} holds {len(downloaded)} previously downloaded IDs.")
+        return downloaded
+    except (sqlite3.Error, OSError, UnicodeDecodeError) as e:
+        print(f"\nCould not use tracking index {db_file} ({e}); reading the tracking file instead.")
+        return load_downloaded_ids(tracking_file)
+
+def confirm_tracked_ids(tracking_file, candidate_ids):
+    """Returns the candidate IDs that really appear in the tracking file, in one streaming pass.
+
+    Makes _BloomFilter hits exact, and reads back the IDs a batch run appended, holding only the candidates in memory.
+    """
+    candidate_ids = set(candidate_ids)
+    found = set()
+    if not candidate_ids: return found
+    try:
+        with open(tracking_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                clean_id = line.strip()
+                if clean_id in candidate_ids: found.add(clean_id)
+    except FileNotFoundError: pass
+    except Exception as e: print(f"\nError reading tracking file {tracking_file}: {e}")
+    return found
+
+def archived_youtube_ids(archive_file, candidate_ids):
+    """Returns the candidate YouTube video IDs listed in yt-dlp's --download-archive file ('youtube <id>' lines)."""
+    candidate_ids = set(candidate_ids)
+    found = set()
+    try:
+        with open(archive_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                extractor, _, video_id = line.strip().partition(' ')
+                if extractor == 'youtube' and video_id in candidate_ids: found.add(video_id)
+    except FileNotFoundError: pass
+    except Exception as e: print(f"\nError reading yt-dlp archive {archive_file}: {e}")
+    return found
+
+def scan_existing_downloads(output_dir, download_format):
+    """Returns the tracking IDs of finished downloads already in output_dir (from '... [ID].ext' filenames)."""
+    id_re = _EXISTING_FILE_ID_RES.get(download_format, _EXISTING_FILE_ID_RES['audio'])
+    try:
+        with os.scandir(output_dir) as entries:
+            return {match.group(1) for entry in entries if entry.is_file() for match in [id_re.search(entry.name)] if match}
+    except OSError as e: print(f"Could not scan output directory {output_dir}: {e}"); return set()
+
+def log_downloaded_id(tracking_fp, item_id):
+    """Appends a successfully downloaded ID (Spotify or YouTube) to the open tracking file."""
     try:
-        with open(tracking_file, 'a', encoding='utf-8') as f:
-            f.write(item_id + '\n')
-    except Exception as e: print(f"Error writing ID {item_id} to tracking file {tracking_file}: {e}")
+        tracking_fp.write(item_id + '\n')
+    except Exception as e: print(f"Error writing ID {item_id} to tracking file {tracking_fp.name}: {e}")
 
-def run_yt_dlp_command(command_list, yt_dlp_executable):
+def run_yt_dlp_command(command_list, yt_dlp_executable, output_prefix=''):
+    """Runs yt-dlp, streaming its output live (prefixed per task) while keeping only the last lines in memory."""
     # Ensure first element is the correct executable path if needed
     if command_list[0] != yt_dlp_executable:
         command_list.insert(0, yt_dlp_executable)
 
-    # print(f"  DEBUG: Running command: {' '.join(command_list)}") # Uncomment for debug
+    if VERBOSE: print(f"{output_prefix}Running:", shlex.join(command_list))
     try:
-        result = subprocess.run(command_list, capture_output=True, text=True, check=False, encoding='utf-8')
-        return result
+        last_lines = collections.deque(maxlen=YT_DLP_OUTPUT_TAIL_LINES)
+        # The context manager closes the pipe and reaps yt-dlp even if reading stops on an exception
+        with subprocess.Popen(command_list, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, encoding='utf-8', errors='replace', bufsize=1) as process:
+            for line in process.stdout:
+                last_lines.append(line)
+                sys.stdout.write(f"{output_prefix}{line}")
+        return SimpleNamespace(returncode=process.returncode, stdout='', stderr=''.join(last_lines))
     except FileNotFoundError: print(f"\nERROR: '{yt_dlp_executable}' command not found."); return None
     except Exception as e: print(f"  Error running subprocess: {e}"); return None
 
-def build_yt_dlp_command(link, output_template_path, download_format, use_cookies=False):
+def firefox_cookies_available():
+    """Checks once whether a Firefox profile with a cookie database exists for yt-dlp to read."""
+    home = os.path.expanduser('~')
+    profile_roots = [
+        os.path.join(home, '.mozilla', 'firefox'), # Linux
+        os.path.join(home, 'snap', 'firefox', 'common', '.mozilla', 'firefox'), # Linux (snap)
+        os.path.join(home, '.var', 'app', 'org.mozilla.firefox', '.mozilla', 'firefox'), # Linux (flatpak)
+        os.path.join(home, 'Library', 'Application Support', 'Firefox'), # macOS
+    ]
+    if os.getenv('APPDATA'): profile_roots.append(os.path.join(os.getenv('APPDATA'), 'Mozilla', 'Firefox')) # Windows
+    # Profiles sit directly under the root (Linux) or under Profiles/ (macOS/Windows); don't walk their contents
+    for root in profile_roots:
+        for pattern in (os.path.join(root, '*', 'cookies.sqlite'), os.path.join(root, 'Profiles', '*', 'cookies.sqlite')):
+            if glob.glob(pattern): return True
+    return False
+
+def build_yt_dlp_command(link, output_template_path, download_format, use_cookies=False, batch_file=None, archive_file=None, concurrent_fragments=1):
     """Builds the yt-dlp command list based on user choices."""
     # Base command starts with executable placeholder, link added later
     # We will prepend the actual executable path in run_yt_dlp_command if needed
@@ -172,6 +528,10 @@ def build_yt_dlp_command(link, output_template_path, download_format, use_cookie
     if use_cookies:
         base_command.extend(['--cookies-from-browser', 'firefox'])
 
+    # Let yt-dlp skip videos it has already downloaded (keyed by video ID, whichever task linked it)
+    if archive_file:
+        base_command.extend(['--download-archive', archive_file])
+
     # Add format-specific options
     if download_format == 'audio':
         base_command.extend([
@@ -190,15 +550,107 @@ def build_yt_dlp_command(link, output_template_path, download_format, use_cookie
          print(f"Warning: Unknown download format '{download_format}', defaulting to audio.")
          base_command.extend(['-x', '--audio-format', 'mp3', '--audio-quality', '0'])
 
+    # Fetch HLS/DASH fragments of a single video in parallel (1 is yt-dlp's default)
+    if concurrent_fragments > 1:
+        base_command.extend(['-N', str(concurrent_fragments)])
 
-    # Add output template and the link URL
-    base_command.extend(['-o', output_template_path, link])
+    # Add output template and the link URL (or a batch file of URLs)
+    base_command.extend(['-o', output_template_path])
+    base_command.extend(['-a', batch_file] if batch_file else [link])
 
     return base_command
 
+def build_yt_dlp_options(output_template_path, download_format, use_cookies=False, archive_file=None, concurrent_fragments=1):
+    """Builds YoutubeDL options equivalent to build_yt_dlp_command, for in-process downloads."""
+    options = {'outtmpl': output_template_path, 'quiet': not VERBOSE, 'noprogress': not VERBOSE, 'concurrent_fragment_downloads': concurrent_fragments}
+    if use_cookies: options['cookiesfrombrowser'] = ('firefox',)
+    if archive_file: options['download_archive'] = archive_file
+    if download_format == 'video':
+        options.update({'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best', 'merge_output_format': 'mp4'})
+    else:
+        # Same as '-x --audio-format mp3 --audio-quality 0'
+        options.update({'format': 'bestaudio/best', 'postprocessors': [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3', 'preferredquality': '0'}]})
+    return options
+
+class _YtDlpLog:
+    """yt_dlp logger keeping the last messages (like run_yt_dlp_command's tail); echoes warnings/errors, the rest if VERBOSE."""
+    def __init__(self, output_prefix=''):
+        self.lines = collections.deque(maxlen=YT_DLP_OUTPUT_TAIL_LINES)
+        self.output_prefix = output_prefix
+
+    def _log(self, message, echo):
+        self.lines.append(f"{message}\n")
+        if echo: sys.stdout.write(f"{self.output_prefix}{message}\n")
+
+    def debug(self, message): self._log(message, VERBOSE)
+    def info(self, message): self._log(message, VERBOSE)
+    def warning(self, message): self._log(message, True)
+    def error(self, message): self._log(message, True)
+
+def run_yt_dlp_in_process(link, options, output_prefix=''):
+    """Downloads one link with the yt_dlp Python API, avoiding a new interpreter + extractor import per task.
+
+    Each call uses its own YoutubeDL instance (it isn't thread-safe, and outtmpl differs per task); the module and
+    its extractors are imported once per process. Returns the same shape as run_yt_dlp_command, or None if yt_dlp
+    isn't installed.
+    """
+    if yt_dlp is None: print("\nERROR: The yt_dlp Python package is not installed."); return None
+    log = _YtDlpLog(output_prefix) # Captures messages such as archive skips and auth errors for the caller
+    try:
+        with yt_dlp.YoutubeDL(dict(options, logger=log)) as ydl:
+            returncode = ydl.download([link])
+        return SimpleNamespace(returncode=returncode, stdout='', stderr=''.join(log.lines))
+    except yt_dlp.utils.DownloadError as e: return SimpleNamespace(returncode=1, stdout='', stderr=''.join(log.lines) + str(e))
+    except Exception as e: print(f"  Error running yt_dlp: {e}"); return SimpleNamespace(returncode=1, stdout='', stderr=''.join(log.lines) + str(e))
+
+def download_one(link, output_template_path, download_format, use_cookies, archive_file, yt_dlp_executable, in_process=False, output_prefix='', concurrent_fragments=1):
+    """Runs a single download attempt via the yt_dlp API (in_process) or a yt-dlp subprocess."""
+    if in_process:
+        return run_yt_dlp_in_process(link, build_yt_dlp_options(output_template_path, download_format, use_cookies, archive_file, concurrent_fragments), output_prefix)
+    command = build_yt_dlp_command(link, output_template_path, download_format, use_cookies=use_cookies, archive_file=archive_file, concurrent_fragments=concurrent_fragments)
+    return run_yt_dlp_command(command, yt_dlp_executable, output_prefix=output_prefix)
+
+def run_batch_download(pending, output_dir, download_format, tracking_file, archive_file, yt_dlp_executable, concurrent_fragments=1):
+    """Downloads all pending YouTube playlist tasks in a single yt-dlp process via a batch file.
+
+    Only valid when the filename and tracking ID both come from yt-dlp itself (YouTube playlists),
+    since a batch run cannot carry per-link names. Tasks must already be filtered against the tracking
+    IDs. yt-dlp appends each finished video ID to the tracking file. Runs without browser cookies: the per-task
+    path only uses them as a retry after an authentication error, and a batch run has no such retry.
+    Returns (success_count, skipped_count, failed_count), or None if yt-dlp failed to start.
+    """
+    # yt-dlp would skip videos already in its archive without --print-to-file reporting them; count those as skips
+    archived = archived_youtube_ids(archive_file, (task['episode_id'] for task in pending))
+    pending = [task for task in pending if task['episode_id'] not in archived]
+    print(f"\nBatch mode: {len(pending)} to download in one yt-dlp run, {len(archived)} already in the yt-dlp archive.")
+    if not pending: return 0, len(archived), 0
+
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False, encoding='utf-8') as batch_fp:
+        batch_fp.write('\n'.join(task['link'] for task in pending) + '\n')
+    try:
+        output_template = os.path.join(output_dir, "%(upload_date)s - %(title)s [%(id)s].%(ext)s")
+        command = build_yt_dlp_command(None, output_template, download_format, use_cookies=False, batch_file=batch_fp.name, archive_file=archive_file, concurrent_fragments=concurrent_fragments)
+        command[1:1] = ['--ignore-errors', '--print-to-file', 'after_move:%(id)s', tracking_file]
+        result = run_yt_dlp_command(command, yt_dlp_executable)
+    finally:
+        os.remove(batch_fp.name)
+    if result is None: return None
+
+    # Pending IDs weren't tracked before the run, so any that are tracked now were downloaded by it
+    tracked_after_run = confirm_tracked_ids(tracking_file, (task['episode_id'] for task in pending))
+    success_count = sum(1 for task in pending if task['episode_id'] in tracked_after_run)
+    return success_count, len(archived), len(pending) - success_count
+
 
 # --- Argument Parser Setup ---
 
+def _positive_int(value):
+    """argparse type for counts and rates that must be at least 1."""
+    try: number = int(value)
+    except ValueError: raise argparse.ArgumentTypeError(f"invalid int value: '{value}'")
+    if number < 1: raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
 def setup_arg_parser():
     """Sets up the argparse parser."""
     parser = argparse.ArgumentParser(
@@ -226,6 +678,46 @@ def setup_arg_parser():
         default="yt-dlp", # Default assumes yt-dlp is in PATH
         help="Path to the yt-dlp executable if not in system PATH."
     )
+    parser.add_argument(
+        "-j", "--jobs", "--concurrency",
+        dest="jobs",
+        type=_positive_int,
+        default=4,
+        help="Number of downloads to run in parallel (2+ also overlaps one video's ffmpeg post-processing with the next download)."
+    )
+    parser.add_argument(
+        "-N", "--concurrent-fragments",
+        type=_positive_int,
+        default=YT_DLP_CONCURRENT_FRAGMENTS,
+        help="Fragments of a single video (HLS/DASH) that yt-dlp downloads in parallel."
+    )
+    parser.add_argument(
+        "--spotify-rate",
+        type=_positive_int,
+        default=SPOTIFY_REQUESTS_PER_SECOND,
+        help="Maximum sustained Spotify API requests per second when fetching playlist/show pages."
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=int,
+        default=SPOTIFY_CACHE_TTL_SECONDS,
+        help="Seconds to reuse a Spotify playlist/show listing cached in the output directory. 0 disables the cache."
+    )
+    parser.add_argument(
+        "--tracking-db",
+        action="store_true",
+        help="Keep a SQLite index of the tracking file in the output directory so large histories aren't loaded into memory on every run."
+    )
+    parser.add_argument(
+        "--in-process",
+        action="store_true",
+        help="Download with the yt_dlp Python package in this process instead of spawning a yt-dlp executable per video."
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Download YouTube playlists with a single yt-dlp process (batch file) instead of one process per video."
+    )
     return parser
 
 # --- Main Application Logic ---
@@ -254,6 +746,9 @@ def run():
     output_dir = args.output
     tracking_file_name = "downloaded_media.log"
     tracking_file_path = os.path.join(output_dir, tracking_file_name)
+    archive_file_path = os.path.join(output_dir, "yt_dlp_archive.txt") # yt-dlp's own --download-archive
+    tracking_db_path = os.path.join(output_dir, "downloaded_media.sqlite3") # Optional index over the tracking file
+    spotify_cache_dir = os.path.join(output_dir, "spotify_cache") # One JSON Lines file per playlist/show (--cache-ttl)
     yt_dlp_executable = args.yt_dlp_path # Use provided path or default 'yt-dlp'
 
     try:
@@ -266,43 +761,51 @@ def run():
     # === Step 2: Initialize Spotify client only if needed ===
     sp = None
     if item_type.startswith('spotify_'):
+        client_id, client_secret = _spotify_creds()
         if not client_id or not client_secret:
             print("\nERROR: Spotify Client ID/Secret not found. Set via .env or environment variables.")
             sys.exit(1)
         try:
-            auth_manager = SpotifyClientCredentials(client_id=client_id, client_secret=client_secret)
-            sp = spotipy.Spotify(auth_manager=auth_manager)
+            # One pooled session for both token requests and API pages, so neither opens its own connections
+            spotify_session = build_spotify_session()
+            auth_manager = SpotifyClientCredentials(client_id=client_id, client_secret=client_secret, requests_session=spotify_session)
+            sp = spotipy.Spotify(auth_manager=auth_manager, requests_session=spotify_session)
             print("Successfully authenticated with Spotify API.")
         except Exception as e: print(f"ERROR: Spotify Auth Failed: {e}"); sys.exit(1)
 
     # === Step 3: Prepare Download Tasks ===
     download_tasks = []
-    source_episodes = []
     print(f"\nPreparing download tasks (Format: {args.format})...")
 
-    if item_type == 'spotify_playlist': source_episodes = fetch_episodes_from_playlist(sp, item_id)
-    elif item_type == 'spotify_show': source_episodes = fetch_episodes_from_show(sp, item_id)
-    elif item_type == 'youtube_playlist':
-        youtube_items = fetch_youtube_playlist_items(item_id, yt_dlp_executable) # item_id is URL here
-        if youtube_items is None: print("Failed to fetch YouTube playlist items. Exiting."); sys.exit(1)
-        download_tasks = youtube_items
-
-    if item_type.startswith('spotify_'):
-        if source_episodes is None: print("Failed to fetch Spotify episodes. Exiting."); sys.exit(1)
-        if not source_episodes: print("No episodes found in the Spotify source."); sys.exit(0)
+    # One lookup per source type. Spotify fetchers return generators (episodes are fetched page by page and
+    # scanned as they arrive); the YouTube fetcher returns ready-made tasks, or None on failure.
+    cache_file = os.path.join(spotify_cache_dir, f"{item_type}_{item_id}.jsonl")
+    source_fetchers = {
+        'spotify_playlist': lambda: iter_cached_episodes(cache_file, lambda: iter_episodes_from_playlist(sp, item_id, args.spotify_rate), args.cache_ttl),
+        'spotify_show': lambda: iter_cached_episodes(cache_file, lambda: iter_episodes_from_show(sp, item_id, args.spotify_rate), args.cache_ttl),
+        'youtube_playlist': lambda: fetch_youtube_playlist_items(item_id, yt_dlp_executable), # item_id is URL here
+    }
+    fetch_source = source_fetchers.get(item_type)
+    if fetch_source is None: print(f"\nERROR: {item_type.replace('_', ' ').title()} URLs are not supported. Use a playlist or show URL."); sys.exit(1)
+    source = fetch_source()
+
+    if item_type == 'youtube_playlist':
+        if source is None: print("Failed to fetch YouTube playlist items. Exiting."); sys.exit(1)
+        download_tasks = source
+    else:
         print("\n--- Scanning Spotify Episode Descriptions for YouTube Links ---")
         unique_links_found = set()
-        for episode in source_episodes:
-            if not episode['description']: continue
-            youtube_links = find_youtube_links(episode['description'])
-            if youtube_links:
+        try:
+            for episode, youtube_links in find_youtube_links_by_episode(source):
                 print(f"  Found {len(youtube_links)} link(s) in: {episode['name']} (ID: {episode['id']})")
-                for link in youtube_links:
-                    clean_link = link.strip()
-                    if clean_link and clean_link not in unique_links_found:
-                        download_tasks.append({'link': clean_link, 'episode_name': episode['name'], 'episode_id': episode['id']})
-                        unique_links_found.add(clean_link)
-        if not download_tasks and not item_type == 'youtube_playlist': print("\nNo YouTube links found in Spotify descriptions."); sys.exit(0)
+                # Matches never contain whitespace, so no strip() is needed. Drop in-description repeats
+                # (dict keeps link order, unlike a set difference), then skip links seen in earlier episodes.
+                new_links = [link for link in dict.fromkeys(youtube_links) if link not in unique_links_found]
+                download_tasks.extend({'link': link, 'episode_name': episode['name'], 'episode_id': episode['id']} for link in new_links)
+                unique_links_found.update(new_links)
+        except spotipy.SpotifyException as e: print(f"Spotify API Error: {e}\nFailed to fetch Spotify episodes. Exiting."); sys.exit(1)
+        except Exception as e: print(f"Unexpected error fetching Spotify episodes: {e}\nFailed to fetch Spotify episodes. Exiting."); sys.exit(1)
+        if not download_tasks: print("\nNo YouTube links found in Spotify descriptions."); sys.exit(0)
         if unique_links_found: print(f"\n--- Found {len(unique_links_found)} unique YouTube links from Spotify descriptions ---")
 
     # === Step 4: Check Tasks ===
@@ -311,72 +814,169 @@ def run():
 
     # === Step 5: Download Media ===
     print(f"\n--- Starting Downloads to '{os.path.abspath(output_dir)}' (Tracking via '{tracking_file_path}') ---")
-    downloaded_ids = load_downloaded_ids(tracking_file_path) # Use full path
+    downloaded_ids = open_tracking_db(tracking_db_path, tracking_file_path) if args.tracking_db else load_downloaded_ids(tracking_file_path)
+    # Files already on disk count as downloaded even if the tracking file doesn't know them (avoids spawning yt-dlp)
+    on_disk_ids = scan_existing_downloads(output_dir, args.format)
+    existing_ids = {file_id for file_id in on_disk_ids if file_id not in downloaded_ids}
+    if existing_ids: print(f"Found {len(existing_ids)} already downloaded file(s) in the output directory not in the tracking file.")
+    downloaded_ids.update(existing_ids)
+    already_downloaded = downloaded_ids
+    if isinstance(downloaded_ids, _BloomFilter):
+        # A filter hit may be a false positive, which would skip an episode forever; confirm this run's hits exactly
+        filter_hits = {task.get('episode_id') for task in download_tasks if task.get('episode_id') in downloaded_ids}
+        already_downloaded = (filter_hits & on_disk_ids) | confirm_tracked_ids(tracking_file_path, filter_hits - on_disk_ids)
+        print(f"Confirmed {len(already_downloaded)} of {len(filter_hits)} tracking filter hit(s) against the tracking file.")
+    tracking_lock = threading.Lock() # Guards downloaded_ids and the tracking file across workers
     success_count, skipped_count, failed_count = 0, 0, 0
     yt_dlp_missing_error = False
 
-    for i, task in enumerate(download_tasks):
-        link = task['link']
+    # Filter untrackable and already-downloaded items up front so workers only see real work. Links sharing a
+    # tracking ID are grouped into one task (tried in order until one succeeds), so later links remain fallbacks
+    # without two workers downloading to the same filename.
+    pending_by_id = {}
+    for task in download_tasks:
+        tracking_id = task.get('episode_id', 'UnknownID')
+        if tracking_id == 'UnknownID': print(f"  WARNING: Skipping item - cannot track without a valid ID: {task['link']}"); failed_count += 1
+        elif tracking_id in already_downloaded: skipped_count += 1
+        elif tracking_id in pending_by_id: pending_by_id[tracking_id]['links'].append(task['link'])
+        else: pending_by_id[tracking_id] = dict(task, links=[task['link']])
+    pending_tasks = list(pending_by_id.values())
+    print(f"Skipping {skipped_count} already downloaded item(s). {len(pending_tasks)} item(s) to download.")
+
+    # Check for yt-dlp once up front rather than letting every worker hit FileNotFoundError/ImportError
+    if args.in_process and args.batch: print("Note: --batch runs yt-dlp as a subprocess; ignoring --in-process for it.")
+    if args.in_process and not args.batch:
+        if pending_tasks and yt_dlp is None:
+            print("\nERROR: --in-process requires the yt_dlp Python package (poetry install).")
+            yt_dlp_missing_error = True
+            pending_tasks = []
+    elif pending_tasks and shutil.which(yt_dlp_executable) is None:
+        print(f"\nERROR: '{yt_dlp_executable}' command not found.")
+        yt_dlp_missing_error = True
+        pending_tasks = []
+
+    # Detect Firefox cookies once so failed downloads don't spawn a cookie retry that can't succeed.
+    # Only per-task downloads retry with cookies, so skip the check when there's nothing to download or in batch mode.
+    use_firefox_cookies = False
+    if pending_tasks and not (args.batch and item_type == 'youtube_playlist'):
+        use_firefox_cookies = firefox_cookies_available()
+        if not use_firefox_cookies: print("No Firefox cookie database found; the cookie-based retry is disabled for this run.")
+
+    yt_dlp_unavailable = threading.Event() # Set by the first worker that fails to start yt-dlp; stops the rest
+    stop_requested = threading.Event() # Set on Ctrl+C; workers only ever see it through this flag
+    interrupted = False
+    output_dir_prefix = os.path.join(output_dir, '') # Joined once: 'dir' -> 'dir/', '.' (the default) -> './'
+
+    def download_link(link, full_output_template, prefix):
+        """Runs the standard attempt and, on an authentication error, the Firefox cookie retry for one link.
+
+        Returns 'success', 'archived' (yt-dlp skipped it: another item already downloaded this video), 'failed',
+        'interrupted' (Ctrl+C), or None if yt-dlp could not be started.
+        """
+        print(f"{prefix} Attempt 1: Standard Download ({args.format})...")
+        result1 = download_one(link, full_output_template, args.format, False, archive_file_path, yt_dlp_executable, args.in_process, output_prefix=f"{prefix}   ", concurrent_fragments=args.concurrent_fragments)
+        if result1 is None: return None
+        if result1.returncode == 0 and _ARCHIVED_RE.search(result1.stderr): print(f"{prefix} Status: SKIPPED (video already downloaded for another item, per the yt-dlp archive)"); return 'archived'
+        if result1.returncode == 0: print(f"{prefix} Status: SUCCESS (Standard)"); return 'success'
+        # Ctrl+C also reaches yt-dlp (same process group), so a failure now is the interrupt, not a real error
+        if stop_requested.is_set(): return 'interrupted'
+        print(f"{prefix} Attempt 1 Failed (Exit Code: {result1.returncode}).")
+        if not use_firefox_cookies: return 'failed'
+        if _AUTH_ERR_RE.search(result1.stderr) is None: print(f"{prefix} Not an authentication error; skipping the Firefox cookie retry."); return 'failed'
+        # Attempt 2: With Cookies (skipped for the whole run when no Firefox profile exists)
+        print(f"{prefix} Attempt 2: Trying with Firefox cookies ({args.format})...")
+        result2 = download_one(link, full_output_template, args.format, True, archive_file_path, yt_dlp_executable, args.in_process, output_prefix=f"{prefix}   ", concurrent_fragments=args.concurrent_fragments)
+        if result2 is None: return None
+        if result2.returncode == 0 and _ARCHIVED_RE.search(result2.stderr): print(f"{prefix} Status: SKIPPED (video already downloaded for another item, per the yt-dlp archive)"); return 'archived'
+        if result2.returncode == 0: print(f"{prefix} Status: SUCCESS (with Firefox Cookies)"); return 'success'
+        if stop_requested.is_set(): return 'interrupted'
+        print(f"{prefix} Attempt 2 Failed (Exit Code: {result2.returncode}).")
+        return 'failed'
+
+    def process_task(index, task):
+        """Downloads a single pending task, trying its links in order. Returns ('success'|'skipped'|'failed'|'aborted', tracking_id)."""
+        if yt_dlp_unavailable.is_set() or stop_requested.is_set(): return 'aborted', task.get('episode_id', 'UnknownID')
+        links = task['links']
         item_name = task.get('episode_name', 'Unknown Item')
         tracking_id = task.get('episode_id', 'UnknownID')
+        prefix = f"[{index+1}/{len(pending_tasks)}]"
+
+        # Full path for yt-dlp's -o argument - yt-dlp handles the extension based on format
+        full_output_template = f"{output_dir_prefix}%(upload_date)s - {sanitize_filename(item_name)} [{tracking_id}].%(ext)s"
+
+        # One write per banner so concurrent workers don't interleave its lines
+        banner = [f"\n{prefix} Processing Task:", f"  Name: {item_name}", f"  ID (for tracking): {tracking_id}"]
+        banner += [f"  Source Link: {link}" for link in links]
+        if VERBOSE: banner.append(f"  Output Pattern: {full_output_template}")
+        print('\n'.join(banner))
+
+        # --- Download Attempts (next link only if the previous one failed) ---
+        for link_number, link in enumerate(links, 1):
+            if stop_requested.is_set(): return 'aborted', tracking_id
+            if len(links) > 1: print(f"{prefix} Link {link_number}/{len(links)}: {link}")
+            outcome = download_link(link, full_output_template, prefix)
+            if outcome is None: yt_dlp_unavailable.set(); return 'aborted', tracking_id
+            if outcome == 'interrupted': print(f"{prefix} Status: INTERRUPTED"); return 'aborted', tracking_id
+            # Not tracked: no file exists under this item's name, yt-dlp just skips it again on the next run
+            if outcome == 'archived': return 'skipped', tracking_id
+            if outcome == 'success':
+                # --- Update Tracking ---
+                with tracking_lock:
+                    log_downloaded_id(tracking_fp, tracking_id)
+                    downloaded_ids.add(tracking_id)
+                return 'success', tracking_id
+        print(f"{prefix} Status: FAILED (All attempts failed for: {', '.join(links)})")
+        return 'failed', tracking_id
+
+    if args.batch and item_type != 'youtube_playlist': print("Note: --batch only applies to YouTube playlists; using per-task downloads.")
+    if args.batch and item_type == 'youtube_playlist' and pending_tasks:
+        # pending_tasks is already filtered against downloaded_ids, so the batch run doesn't check again
+        counts = run_batch_download(pending_tasks, output_dir, args.format, tracking_file_path, archive_file_path, yt_dlp_executable, args.concurrent_fragments)
+        if counts is None: yt_dlp_missing_error = True
+        else: success_count, skipped_count, failed_count = success_count + counts[0], skipped_count + counts[1], failed_count + counts[2]
+    else:
+        # Keep the tracking file open (line-buffered) for the whole download phase instead of reopening per success
+        try:
+            tracking_fp = open(tracking_file_path, 'a', encoding='utf-8', buffering=1)
+        except OSError as e:
+            print(f"ERROR: Could not open tracking file '{tracking_file_path}': {e}")
+            sys.exit(1)
 
-        print(f"\n[{i+1}/{len(download_tasks)}] Processing Task:")
-        print(f"  Name: {item_name}")
-        print(f"  ID (for tracking): {tracking_id}")
-        print(f"  Source Link: {link}")
-
-        if tracking_id == 'UnknownID': print("  WARNING: Skipping item - cannot track without a valid ID."); failed_count += 1; continue
-        if tracking_id in downloaded_ids: print("  Status: SKIPPED (ID already in tracking file)"); skipped_count += 1; continue
-
-        # Construct output template *relative* to output dir
-        sanitized_name = sanitize_filename(item_name)
-        # Filename pattern - yt-dlp handles the extension based on format
-        base_filename_pattern = f"%(upload_date)s - {sanitized_name} [{tracking_id}].%(ext)s"
-        # Full path for yt-dlp's -o argument
-        full_output_template = os.path.join(output_dir, base_filename_pattern)
-        print(f"  Output Pattern: {full_output_template}")
-
-        # --- Download Attempts ---
-        download_successful = False
-        # Attempt 1: Standard
-        cmd1 = build_yt_dlp_command(link, full_output_template, args.format, use_cookies=False)
-        print(f"  Attempt 1: Standard Download ({args.format})...")
-        result1 = run_yt_dlp_command(cmd1, yt_dlp_executable)
-        if result1 is None: yt_dlp_missing_error = True; break
-
-        if result1.returncode == 0:
-            print("  Status: SUCCESS (Standard)")
-            download_successful = True
-        else:
-            print(f"  Attempt 1 Failed (Exit Code: {result1.returncode}).")
-            # Attempt 2: With Cookies
-            cmd2 = build_yt_dlp_command(link, full_output_template, args.format, use_cookies=True)
-            print(f"  Attempt 2: Trying with Firefox cookies ({args.format})...")
-            result2 = run_yt_dlp_command(cmd2, yt_dlp_executable)
-            if result2 is None: yt_dlp_missing_error = True; break
-            if result2.returncode == 0:
-                print("  Status: SUCCESS (with Firefox Cookies)")
-                download_successful = True
-            else:
-                print(f"  Attempt 2 Failed (Exit Code: {result2.returncode}).")
-
-        # --- Update Tracking ---
-        if download_successful:
-            log_downloaded_id(tracking_file_path, tracking_id) # Use full path
-            downloaded_ids.add(tracking_id)
-            success_count += 1
-        else:
-            print(f"  Status: FAILED (Both attempts failed for link: {link})")
-            # Optionally log the actual error output from yt-dlp here
-            # if result1: print(f"  Stderr 1: {result1.stderr[:300]}...")
-            # if result2: print(f"  Stderr 2: {result2.stderr[:300]}...")
-            failed_count += 1
-
-        if yt_dlp_missing_error: break
+        # Downloads are network/disk/ffmpeg bound, so run them through a bounded worker pool. Each worker blocks on
+        # its own yt-dlp (including the ffmpeg step), so one task's post-processing overlaps the others' downloads.
+        # The pool exits (joining all workers) before the tracking file is closed.
+        with tracking_fp, ThreadPoolExecutor(max_workers=args.jobs) as executor:
+            started_at = time.monotonic()
+            futures = [executor.submit(process_task, i, task) for i, task in enumerate(pending_tasks)]
+            counted = set()
+            def tally(future):
+                nonlocal success_count, skipped_count, failed_count
+                counted.add(future)
+                status, _ = future.result()
+                if status == 'success': success_count += 1
+                elif status == 'failed': failed_count += 1
+                elif status == 'skipped': skipped_count += 1
+                return status
+            try:
+                for completed, future in enumerate(as_completed(futures), 1):
+                    if tally(future) != 'aborted' and completed < len(futures):
+                        # pending_tasks holds only real work, so the average so far is a fair estimate for the rest
+                        eta = (time.monotonic() - started_at) / completed * (len(futures) - completed)
+                        print(f"--- Progress: {completed}/{len(futures)} done, about {eta:.0f}s remaining ---")
+            except KeyboardInterrupt:
+                # Only the main thread gets KeyboardInterrupt: drop queued tasks and stop running workers from
+                # starting another attempt or link, then wait for them so the tracking file is complete.
+                stop_requested.set(); interrupted = True
+                print("\nInterrupted: cancelling queued downloads and waiting for running ones to stop...")
+                executor.shutdown(wait=True, cancel_futures=True)
+                for future in futures:
+                    if future not in counted and not future.cancelled(): tally(future)
+        if yt_dlp_unavailable.is_set(): yt_dlp_missing_error = True
 
     # === Step 6: Summary ===
     print("\n--- Run Summary ---")
     if yt_dlp_missing_error: print(f"Processing stopped: '{yt_dlp_executable}' command not found or failed to run.")
+    if interrupted: print("Processing interrupted (Ctrl+C); remaining items will be downloaded on the next run.")
     print(f"Output directory: {os.path.abspath(output_dir)}")
     print(f"Successfully downloaded: {success_count}")
     print(f"Skipped (already downloaded): {skipped_count}")
@@ -384,6 +984,7 @@ def run():
     print(f"Total tasks processed/attempted: {success_count + skipped_count + failed_count}")
 
     print("\nScript finished.")
+    if interrupted: sys.exit(130)
 
 
 # --- Script Entry Point ---